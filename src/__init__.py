@@ -1,39 +1,230 @@
+import asyncio
+import os
 from contextlib import asynccontextmanager
+from typing import Optional
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
+from slowapi.util import get_remote_address
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
-from .config import get_config, global_share, limiter, set_session_maker
-from .routes import account, email
-from .smtp import SMTPClientFactory, SMTPConnectionPool
+from .admission import (
+    AdmissionControlMiddleware,
+    ConcurrencyLimiter,
+    get_route_path,
+)
+from .audit import (
+    AuditEventType,
+    AuditLog,
+    DatabaseAuditSink,
+    NDJSONAuditSink,
+    get_audit_log,
+    record_audit_event,
+    set_audit_log,
+)
+from .config import (
+    ConfigSnapshot,
+    ConfigWatcher,
+    get_config_snapshot,
+    get_data_path,
+    global_share,
+    limiter,
+    set_session_maker,
+)
+from .models import Config
+from .routes import account, email, status
+from .smtp import SMTPClientFactory, SMTPConnectionPool, SMTPSender
 from .sql import Base
 
 
+def build_smtp_client_factory(config: Config) -> SMTPClientFactory:
+    return SMTPClientFactory(
+        hostname=config.smtp_host,
+        use_tls=config.smtp_use_tls,
+        port=config.smtp_port,
+        username=config.smtp_username,
+        password=config.smtp_password,
+    )
+
+
+def build_admission_limiters(
+    config: Config, previous: Optional[dict[str, ConcurrencyLimiter]] = None
+) -> dict[str, ConcurrencyLimiter]:
+    """按路径构建准入控制限流器。
+
+    :param previous: 当前使用的限流器。名称与限制参数均未变化的分组会沿用原限流器，
+        以保留进行中的请求与计数；参数变化的分组换用新限流器，
+        此时旧限流器上进行中的请求仍会完成，切换期间总并发可能暂时超过上限"""
+    reusable = {limiter.name: limiter for limiter in (previous or {}).values()}
+    admission_limiters = {}
+    for name, group in config.admission_control.items():
+        limiter = reusable.get(name)
+        if limiter is None or (
+            limiter.max_concurrency,
+            limiter.max_queue,
+            limiter.queue_timeout,
+            limiter.retry_after,
+        ) != (
+            group.max_concurrency,
+            group.max_queue,
+            group.queue_timeout,
+            group.retry_after,
+        ):
+            limiter = ConcurrencyLimiter(
+                name,
+                max_concurrency=group.max_concurrency,
+                max_queue=group.max_queue,
+                queue_timeout=group.queue_timeout,
+                retry_after=group.retry_after,
+            )
+        for path in group.paths:
+            admission_limiters[path] = limiter
+    return admission_limiters
+
+
+def prepare_config_snapshot(snapshot: ConfigSnapshot):
+    """预先构建配置快照的派生缓存"""
+    snapshot.derived(account.load_jwt_keys)
+    snapshot.derived(email.build_restricted_email_domains)
+    snapshot.derived(email.build_message_template)
+    snapshot.derived(build_smtp_client_factory)
+
+
+async def on_config_reload(old: ConfigSnapshot, new: ConfigSnapshot):
+    print(f"已重新加载配置（版本 {old.version} -> {new.version}）")
+    if new.config.db_conn_scheme != old.config.db_conn_scheme:
+        print("db_conn_scheme 的修改需重启后生效")
+    smtp_fields = (
+        "smtp_host",
+        "smtp_port",
+        "smtp_use_tls",
+        "smtp_username",
+        "smtp_password",
+    )
+    if any(
+        getattr(new.config, name) != getattr(old.config, name) for name in smtp_fields
+    ):
+        global_share.smtp_conn_pool.factory = new.derived(build_smtp_client_factory)
+        await global_share.smtp_conn_pool.close()  # 断开连接到旧服务器的空闲连接
+    global_share.smtp_sender.coalesce_window = new.config.smtp_coalesce_window
+    global_share.smtp_sender.max_batch = new.config.smtp_coalesce_max_batch
+    if new.config.admission_control != old.config.admission_control:
+        global_share.admission_limiters = build_admission_limiters(
+            new.config, global_share.admission_limiters
+        )
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    config = get_config()
+    config_snapshot = get_config_snapshot()
+    config = config_snapshot.config
+    prepare_config_snapshot(config_snapshot)
     engine = create_async_engine(config.db_conn_scheme)
+    global_share.engine = engine
     session_maker = async_sessionmaker(engine)
     set_session_maker(session_maker)
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-    smtp_client_factory = SMTPClientFactory(
-        hostname=config.smtp_host,
-        use_tls=config.smtp_use_tls,
-        port=config.smtp_port,
-        username=config.smtp_username,
-        password=config.smtp_password,
+    global_share.smtp_conn_pool = SMTPConnectionPool(
+        config_snapshot.derived(build_smtp_client_factory)
+    )
+    global_share.smtp_sender = SMTPSender(
+        global_share.smtp_conn_pool,
+        coalesce_window=config.smtp_coalesce_window,
+        max_batch=config.smtp_coalesce_max_batch,
     )
-    global_share.smtp_conn_pool = SMTPConnectionPool(smtp_client_factory)
+    global_share.smtp_sender.start()
     global_share.background_tasks = set()
+    global_share.accepting_background_tasks = True
+    global_share.admission_limiters = build_admission_limiters(config)
+    set_audit_log(None)
+    if config.audit_log_sink != "no":
+        if config.audit_log_sink == "database":
+            audit_sink = DatabaseAuditSink(session_maker)
+        else:
+            audit_sink = NDJSONAuditSink(os.path.join(get_data_path(), "audit"))
+        audit_log = AuditLog(
+            audit_sink,
+            buffer_size=config.audit_log_buffer_size,
+            batch_size=config.audit_log_batch_size,
+            flush_interval=config.audit_log_flush_interval,
+        )
+        set_audit_log(audit_log)
+        audit_log.start()
+    global_share.config_watcher = None
+    if config_snapshot.path is not None:
+        global_share.config_watcher = ConfigWatcher(
+            config_snapshot.path,
+            interval=config.config_reload_interval,
+            prepare=prepare_config_snapshot,
+            on_reload=on_config_reload,
+        )
+        global_share.config_watcher.start()
     yield
+    await shutdown(get_config_snapshot().config.shutdown_timeout)
+
+
+async def shutdown(timeout: float) -> int:
+    """有序关闭：停止接受新的后台任务，等待未完成的任务至多 ``timeout`` 秒，
+    然后关闭 SMTP 连接池，写入剩余的审计事件并释放数据库引擎。
+
+    :param timeout: 等待后台任务完成的最长时间（秒）
+    :return: 被丢弃（超时后取消）的后台任务数量"""
+    global_share.accepting_background_tasks = False
+    if global_share.config_watcher is not None:
+        await global_share.config_watcher.close()
+    dropped = 0
+    pending = set(global_share.background_tasks or ())
+    if len(pending) > 0:
+        _, pending = await asyncio.wait(pending, timeout=timeout)
+        dropped = len(pending)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    if dropped > 0:
+        print(f"关闭时丢弃了 {dropped} 个未完成的后台任务")
+    if global_share.smtp_sender is not None:
+        await global_share.smtp_sender.close()
+    if global_share.smtp_conn_pool is not None:
+        await global_share.smtp_conn_pool.close()
+    audit_log = get_audit_log()
+    if audit_log is not None:
+        set_audit_log(None)
+        await audit_log.close()
+        if audit_log.overflowed > 0:
+            print(f"因缓冲区满丢弃了 {audit_log.overflowed} 条审计事件")
+        if audit_log.write_failed > 0:
+            print(f"因写入失败丢弃了 {audit_log.write_failed} 条审计事件")
+    if global_share.engine is not None:
+        await global_share.engine.dispose()
+    return dropped
+
+
+# 被限流时记录审计事件的路由
+RATE_LIMITED_AUDIT_EVENTS: dict[str, AuditEventType] = {
+    "/account/register": "register",
+    "/account/login": "login",
+    "/email/send_verification_code": "send_verification_code",
+}
+
+
+def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded) -> Response:
+    event = RATE_LIMITED_AUDIT_EVENTS.get(get_route_path(request.scope))
+    if event is not None:
+        record_audit_event(
+            event, False, ip=get_remote_address(request), detail="rate_limited"
+        )
+    return _rate_limit_exceeded_handler(request, exc)
 
 
 app = FastAPI(lifespan=lifespan, root_path="/api")
 app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
+app.add_middleware(
+    AdmissionControlMiddleware, get_limiters=lambda: global_share.admission_limiters
+)
 
 app.include_router(account.router)
 app.include_router(email.router)
+app.include_router(status.router)
@@ -0,0 +1,101 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Callable
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+def get_route_path(scope: Scope) -> str:
+    """请求路径去掉 ``root_path`` 前缀后的部分"""
+    path: str = scope["path"]
+    root_path: str = scope.get("root_path", "")
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path) :]
+    return path
+
+
+class AdmissionRejected(Exception):
+    """并发已满且等待队列已满或等待超时"""
+
+
+class ConcurrencyLimiter:
+    """带有有界等待队列与排队超时的并发限制器"""
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        max_queue: int = 0,
+        queue_timeout: float = 1.0,
+        retry_after: int = 1,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.in_flight = 0  # 正在处理的请求数
+        self.queued = 0  # 正在排队的请求数
+        self.rejected = 0  # 累计拒绝的请求数
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @asynccontextmanager
+    async def acquire(self):
+        if self._semaphore.locked():
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise AdmissionRejected()
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except TimeoutError:
+                self.rejected += 1
+                raise AdmissionRejected()
+            finally:
+                self.queued -= 1
+        else:
+            await self._semaphore.acquire()
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+
+class AdmissionControlMiddleware:
+    """按路由进行准入控制，超出容量时立即返回 503 与 Retry-After。
+
+    :param get_limiters: 返回“路径 -> 限制器”映射的函数，路径不含 ``root_path``"""
+
+    def __init__(
+        self, app: ASGIApp, get_limiters: Callable[[], dict[str, ConcurrencyLimiter]]
+    ):
+        self.app = app
+        self.get_limiters = get_limiters
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limiters = self.get_limiters()
+        if not limiters:
+            await self.app(scope, receive, send)
+            return
+        limiter = limiters.get(get_route_path(scope))
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            async with limiter.acquire():
+                await self.app(scope, receive, send)
+        except AdmissionRejected:
+            response = JSONResponse(
+                {"detail": "服务繁忙，请稍后重试"},
+                status_code=503,
+                headers={"Retry-After": str(limiter.retry_after)},
+            )
+            await response(scope, receive, send)
@@ -0,0 +1,179 @@
+import asyncio
+import datetime
+import json
+import os
+import uuid
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Literal, Optional, Protocol
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from .sql import AuditEvent
+
+AuditEventType = Literal["register", "login", "refresh", "send_verification_code"]
+
+
+@dataclass
+class AuditEntry:
+    event: AuditEventType
+    success: bool
+    account_id: Optional[uuid.UUID] = None
+    email: Optional[str] = None
+    ip: Optional[str] = None
+    detail: Optional[str] = None  # 失败原因，如 "domain_rejected"
+    time: float = field(
+        default_factory=lambda: datetime.datetime.now().timestamp()
+    )  # POSIX timestamp
+
+
+class AuditSink(Protocol):
+    async def write(self, entries: list[AuditEntry]): ...
+
+
+class DatabaseAuditSink:
+    """使用多行 INSERT 将审计事件批量写入数据库"""
+
+    def __init__(self, session_maker: async_sessionmaker):
+        self.session_maker = session_maker
+
+    async def write(self, entries: list[AuditEntry]):
+        async with self.session_maker() as session:
+            await session.execute(
+                insert(AuditEvent), [asdict(entry) for entry in entries]
+            )
+            await session.commit()
+
+
+class NDJSONAuditSink:
+    """将审计事件追加到按天轮换的本地 NDJSON 文件"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get_file_path(self, time: float) -> str:
+        day = datetime.datetime.fromtimestamp(time, datetime.timezone.utc).date()
+        return os.path.join(self.directory, f"audit-{day.isoformat()}.ndjson")
+
+    def _write(self, entries: list[AuditEntry]):
+        lines: dict[str, list[str]] = {}
+        for entry in entries:
+            record = asdict(entry)
+            if entry.account_id is not None:
+                record["account_id"] = str(entry.account_id)
+            lines.setdefault(self.get_file_path(entry.time), []).append(
+                json.dumps(record, ensure_ascii=False) + "\n"
+            )
+        for file_path, file_lines in lines.items():
+            with open(file_path, "a", encoding="utf-8") as f:
+                f.writelines(file_lines)
+
+    async def write(self, entries: list[AuditEntry]):
+        await asyncio.to_thread(self._write, entries)
+
+
+class AuditLog:
+    """缓冲的异步审计日志。
+
+    ``record`` 只将事件追加到内存中的有界环形缓冲区，由后台任务批量写入 ``sink``。
+    缓冲区满时丢弃最旧的事件，计入 ``overflowed``；
+    写入失败的事件计入 ``write_failed``。"""
+
+    def __init__(
+        self,
+        sink: AuditSink,
+        buffer_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+    ):
+        self.sink = sink
+        self.buffer: deque[AuditEntry] = deque(maxlen=buffer_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflowed = 0  # 因缓冲区满而丢弃的事件数
+        self.write_failed = 0  # 因写入失败而丢弃的事件数
+        self.written = 0
+        self._wakeup = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self._closing = False
+        self._flush_lock = asyncio.Lock()
+
+    def record(self, entry: AuditEntry):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.overflowed += 1
+        self.buffer.append(entry)
+        if len(self.buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        async with self._flush_lock:
+            while len(self.buffer) > 0:
+                batch = [
+                    self.buffer.popleft()
+                    for _ in range(min(self.batch_size, len(self.buffer)))
+                ]
+                try:
+                    await self.sink.write(batch)
+                    self.written += len(batch)
+                except Exception as e:
+                    self.write_failed += len(batch)
+                    print(f"无法写入 {len(batch)} 条审计事件：{str(e)}")
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        self._flusher = asyncio.create_task(self._run())
+
+    async def close(self):
+        """停止后台写入任务，并写入缓冲区中剩余的事件"""
+        self._closing = True
+        self._wakeup.set()
+        if self._flusher is not None:
+            await self._flusher
+            self._flusher = None
+        await self.flush()
+
+
+_audit_log: AuditLog = None  # 未启用审计日志时为 None
+
+
+def get_audit_log() -> Optional[AuditLog]:
+    return _audit_log
+
+
+def set_audit_log(audit_log: Optional[AuditLog]):
+    global _audit_log
+    _audit_log = audit_log
+
+
+def record_audit_event(
+    event: AuditEventType,
+    success: bool,
+    account_id: Optional[uuid.UUID] = None,
+    email: Optional[str] = None,
+    ip: Optional[str] = None,
+    detail: Optional[str] = None,
+):
+    """记录一条审计事件。仅追加到内存缓冲区，不会等待写入。"""
+    if _audit_log is None:
+        return
+    _audit_log.record(
+        AuditEntry(
+            event=event,
+            success=success,
+            account_id=account_id,
+            email=email,
+            ip=ip,
+            detail=detail,
+        )
+    )
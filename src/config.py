@@ -1,18 +1,47 @@
+import asyncio
+import itertools
 import os
+import signal
 import sys
 import tomllib
 from asyncio import Task
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional, TypeVar
 
-import platformdirs
 from slowapi import Limiter
 from slowapi.util import get_remote_address
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
 
+from .admission import ConcurrencyLimiter
 from .models import Config
-from .smtp import SMTPConnectionPool
+from .smtp import SMTPConnectionPool, SMTPSender
 
-_config: Config = None
+T = TypeVar("T")
+
+
+@dataclass(frozen=True, eq=False)
+class ConfigSnapshot:
+    """不可变的、带版本号的配置快照。
+
+    由配置派生的对象（如解析后的密钥）通过 ``derived`` 按版本缓存，
+    配置更新后随新快照重新构建。"""
+
+    version: int
+    config: Config
+    path: Optional[str] = None  # 配置文件路径，非从文件加载时为 None
+    _derived: dict = field(default_factory=dict, repr=False)
+
+    def derived(self, build: Callable[[Config], T]) -> T:
+        """获取由 ``build`` 从本快照的配置派生的对象，每个版本只构建一次"""
+        try:
+            return self._derived[build]
+        except KeyError:
+            value = self._derived[build] = build(self.config)
+            return value
+
+
+_snapshot: ConfigSnapshot = None
+_snapshot_versions = itertools.count(1)
 _session_maker: async_sessionmaker = None
 
 limiter: Limiter = Limiter(key_func=get_remote_address)
@@ -20,22 +49,46 @@ limiter: Limiter = Limiter(key_func=get_remote_address)
 
 @dataclass
 class GlobalShare:
+    engine: AsyncEngine = None
     smtp_conn_pool: SMTPConnectionPool = None
+    smtp_sender: SMTPSender = None
     background_tasks: set[Task] = None
     # 重要！
     # https://github.com/python/cpython/issues/91887
     # https://docs.python.org/zh-cn/3/library/asyncio-task.html#asyncio.create_task
+    accepting_background_tasks: bool = False  # 关闭时置为 False，不再接受新的后台任务
+    admission_limiters: dict[str, ConcurrencyLimiter] = None  # 路径 -> 限制器
+    config_watcher: "ConfigWatcher" = None  # 配置并非从文件加载时为 None
 
 
 global_share = GlobalShare()
 
 
 def get_config() -> Config:
-    global _config
-    if _config is not None:
-        return _config
+    return get_config_snapshot().config
+
+
+def get_config_snapshot() -> ConfigSnapshot:
+    if _snapshot is not None:
+        return _snapshot
     _load_config()
-    return _config
+    return _snapshot
+
+
+def make_config_snapshot(config: Config, path: Optional[str] = None) -> ConfigSnapshot:
+    return ConfigSnapshot(version=next(_snapshot_versions), config=config, path=path)
+
+
+def set_config_snapshot(snapshot: ConfigSnapshot):
+    """原子地替换当前配置快照"""
+    global _snapshot
+    _snapshot = snapshot
+
+
+def set_config(config: Config) -> ConfigSnapshot:
+    snapshot = make_config_snapshot(config)
+    set_config_snapshot(snapshot)
+    return snapshot
 
 
 def make_session() -> AsyncSession:
@@ -48,22 +101,130 @@ def set_session_maker(session_maker: async_sessionmaker):
 
 
 def get_data_path():
-    data_path = os.getenv(
-        "TW_ACCOUNT_DATA_PATH", platformdirs.user_data_path("tw-account")
-    )
+    data_path = os.getenv("TW_ACCOUNT_DATA_PATH")
+    if data_path is None:
+        import platformdirs  # 设置了 TW_ACCOUNT_DATA_PATH 时（如 Docker 部署）无需导入
+
+        data_path = platformdirs.user_data_path("tw-account")
     if not os.path.isdir(data_path):
         os.makedirs(data_path)
     return data_path
 
 
+def get_config_file_path() -> str:
+    return os.path.join(get_data_path(), "config.toml")
+
+
+def read_config_file(config_file_path: str) -> Config:
+    with open(config_file_path, "rb") as f:
+        return Config(**tomllib.load(f))
+
+
 def _load_config():
-    global _config
-    data_path = get_data_path()
-    config_file_path = os.path.join(data_path, "config.toml")
+    config_file_path = get_config_file_path()
     if not os.path.isfile(config_file_path):
         raise NotImplementedError("设置向导")
     try:
-        _config = Config(**tomllib.load(open(config_file_path, "rb")))
+        config = read_config_file(config_file_path)
     except Exception as e:
         print(f"无法加载配置文件 “{config_file_path}”：{str(e)}")
         sys.exit(1)
+    set_config_snapshot(make_config_snapshot(config, config_file_path))
+
+
+class ConfigWatcher:
+    """在配置文件变更或收到 SIGHUP 时重新加载配置。
+
+    新配置在后台线程中解析，并由 ``prepare`` 预先构建派生缓存，
+    之后才替换当前快照，因此请求路径上不会发生重建。
+
+    :param prepare: 在后台线程中对新快照调用，用于预热派生缓存
+    :param on_reload: 替换快照后调用，参数为旧快照与新快照"""
+
+    def __init__(
+        self,
+        path: str,
+        interval: float = 5.0,
+        prepare: Optional[Callable[[ConfigSnapshot], None]] = None,
+        on_reload: Optional[
+            Callable[[ConfigSnapshot, ConfigSnapshot], Awaitable[None]]
+        ] = None,
+    ):
+        self.path = path
+        self.interval = interval
+        self.prepare = prepare
+        self.on_reload = on_reload
+        self._mtime = self._get_mtime()
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._signal_handler_installed = False
+
+    def _get_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    async def reload(self) -> bool:
+        """重新加载配置文件。
+
+        :return: 是否替换了配置快照。配置无效或未变化时保留当前快照"""
+        async with self._lock:
+            self._mtime = self._get_mtime()
+            current = get_config_snapshot()
+            try:
+                config = await asyncio.to_thread(read_config_file, self.path)
+                if config == current.config:
+                    return False
+                snapshot = make_config_snapshot(config, self.path)
+                if self.prepare is not None:
+                    await asyncio.to_thread(self.prepare, snapshot)
+            except Exception as e:
+                print(f"无法重新加载配置文件 “{self.path}”，继续使用当前配置：{str(e)}")
+                return False
+            set_config_snapshot(snapshot)
+            if self.on_reload is not None:
+                try:
+                    await self.on_reload(current, snapshot)
+                except Exception as e:
+                    print(f"已应用新配置，但更新运行中的组件时出错：{str(e)}")
+            return True
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), self.interval if self.interval > 0 else None
+                )
+            except TimeoutError:
+                if self._get_mtime() == self._mtime:
+                    continue
+            self._wakeup.clear()
+            try:
+                await self.reload()
+            except Exception as e:  # 单次失败不应停止监视
+                print(f"重新加载配置时出错：{str(e)}")
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGHUP, self._wakeup.set)
+            self._signal_handler_installed = True
+        except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+            pass  # 非 Unix 平台或不在主线程中，仅轮询文件
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._signal_handler_installed:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+            self._signal_handler_installed = False
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                print(f"配置监视任务异常退出：{str(e)}")
+            self._task = None
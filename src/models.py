@@ -1,10 +1,22 @@
 import uuid
 from typing import Annotated, Literal, Optional, Self
 
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+
+
+class AdmissionControlGroup(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    paths: list[str]  # 该组包含的路由路径，不含 root_path
+    max_concurrency: Annotated[int, Field(ge=1)]  # 同时处理的最大请求数
+    max_queue: Annotated[int, Field(ge=0)] = 0  # 等待队列的最大长度
+    queue_timeout: Annotated[float, Field(ge=0)] = 1.0  # 排队超时（秒）
+    retry_after: Annotated[int, Field(ge=0)] = 1  # 拒绝时 Retry-After 的值（秒）
 
 
 class Config(BaseModel):
+    model_config = ConfigDict(frozen=True)  # 配置快照不可变，更新时整体替换
+
     db_conn_scheme: str
     email_verification_code_lifespan: float = 300.0
     restrict_email_domains: Literal["no", "blacklist", "whitelist"] = "whitelist"
@@ -29,6 +41,22 @@ class Config(BaseModel):
     smtp_password: Optional[str] = None
     email_verification_code_from_email: str  # 邮件验证码的发件人邮箱
     email_verification_code_from_name: Optional[str] = None  # 邮件验证码的发件人名称
+    smtp_coalesce_window: Annotated[float, Field(ge=0)] = 0.01  # 合并等待窗口（秒）
+    smtp_coalesce_max_batch: Annotated[int, Field(ge=1)] = 100  # 每批最多发送的邮件数
+    config_reload_interval: float = 5.0  # 检查配置文件的间隔（秒），0 为仅响应 SIGHUP
+    shutdown_timeout: float = 10.0  # 关闭时等待后台任务完成的最长时间（秒）
+    admission_control: dict[str, AdmissionControlGroup] = {
+        "account": AdmissionControlGroup(
+            paths=["/account/login", "/account/refresh", "/account/register"],
+            max_concurrency=32,
+            max_queue=64,
+            queue_timeout=2.0,
+        ),
+    }  # 组名 -> 准入控制设置
+    audit_log_sink: Literal["no", "database", "ndjson"] = "database"  # 审计日志写入目标
+    audit_log_buffer_size: Annotated[int, Field(ge=1)] = 10000
+    audit_log_batch_size: Annotated[int, Field(ge=1)] = 500
+    audit_log_flush_interval: Annotated[float, Field(gt=0)] = 1.0  # 秒
 
 
 class EmailDomainRestrictionInfo(BaseModel):
@@ -36,6 +64,14 @@ class EmailDomainRestrictionInfo(BaseModel):
     restricted_email_domains: list[str]
 
 
+class AdmissionStatus(BaseModel):
+    in_flight: int  # 正在处理的请求数
+    queued: int  # 正在排队的请求数
+    rejected: int  # 累计拒绝的请求数
+    max_concurrency: int
+    max_queue: int
+
+
 class Token(BaseModel):
     access_token: str
     token_type: Literal["bearer"] = "bearer"
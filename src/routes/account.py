@@ -17,14 +17,26 @@ from fastapi import (
     status,
 )
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from jwt.algorithms import ECAlgorithm
 from pydantic import Field
+from slowapi.util import get_remote_address
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..config import get_config, limiter, make_session
-from ..models import AccountInfo, RefreshTokenInRequest, Token
+from ..audit import record_audit_event
+from ..config import (
+    get_config,
+    get_config_snapshot,
+    limiter,
+    make_session,
+)
+from ..models import AccountInfo, Config, RefreshTokenInRequest, Token
 from ..sql import Account, RefreshToken
-from .email import allowed_email, verify_email_and_consume_code
+from .email import (
+    allowed_email,
+    audited_allowed_email,
+    verify_email_and_consume_code,
+)
 
 router = APIRouter(prefix="/account")
 
@@ -35,7 +47,7 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="account/login")
 @limiter.limit("10/hour")
 async def register_account(
     request: Request,
-    email: Annotated[str, Depends(allowed_email)],
+    email: Annotated[str, Depends(audited_allowed_email("register"))],
     verify_code: Annotated[str, Field(min_length=6, max_length=6), Body(embed=True)],
 ):
     async with make_session() as session:
@@ -45,23 +57,47 @@ async def register_account(
             raise HTTPException(400, detail="此账户已存在")
 
         if not await verify_email_and_consume_code(email, verify_code):
+            record_audit_event(
+                "register", False, email=email, ip=get_remote_address(request)
+            )
             raise HTTPException(400, detail="验证码错误")
 
-        new_account = Account(email=email, status="NORMAL")
+        account_id = uuid.uuid4()
+        new_account = Account(id=account_id, email=email, status="NORMAL")
 
         session.add(new_account)
 
         await session.commit()
 
+        record_audit_event(
+            "register",
+            True,
+            account_id=account_id,
+            email=email,
+            ip=get_remote_address(request),
+        )
+
+
+def load_jwt_keys(config: Config):
+    """解析 PEM 格式的 ES256 密钥。
+
+    :return: (私钥, 公钥)"""
+    algorithm = ECAlgorithm(ECAlgorithm.SHA256)
+    return (
+        algorithm.prepare_key(config.jwt_es256_private_key),
+        algorithm.prepare_key(config.jwt_es256_public_key),
+    )
+
 
 async def create_access_token(account_id: str) -> str:
-    config = get_config()
+    config_snapshot = get_config_snapshot()
+    (private_key, _) = config_snapshot.derived(load_jwt_keys)
     to_encode = {
         "sub": str(account_id),
         "exp": datetime.datetime.now(datetime.timezone.utc)
-        + datetime.timedelta(seconds=config.access_token_lifespan),
+        + datetime.timedelta(seconds=config_snapshot.config.access_token_lifespan),
     }
-    encoded_jwt = jwt.encode(to_encode, config.jwt_es256_private_key, algorithm="ES256")
+    encoded_jwt = jwt.encode(to_encode, private_key, algorithm="ES256")
     return encoded_jwt
 
 
@@ -117,38 +153,55 @@ async def login(
         email = validate_email(form_data.username).email
     except EmailNotValidError:
         raise HTTPException(400, detail="无效的邮箱地址")
-    await allowed_email(email)  # 检查邮箱域名是否允许
+    ip = get_remote_address(request)
+    try:
+        await allowed_email(email)  # 检查邮箱域名是否允许
+    except HTTPException:
+        record_audit_event("login", False, email=email, ip=ip, detail="domain_rejected")
+        raise
     async with make_session() as session:
         account = (
             await session.execute(select(Account).where(Account.email == email))
         ).scalar_one_or_none()
         if account is None:
+            record_audit_event("login", False, email=email, ip=ip)
             raise HTTPException(
                 status.HTTP_401_UNAUTHORIZED, detail=EMAIL_OR_VERIFICATION_CODE_WRONG
             )
         if not await verify_email_and_consume_code(email, form_data.password):
+            record_audit_event(
+                "login", False, account_id=account.id, email=email, ip=ip
+            )
             raise HTTPException(
                 status.HTTP_401_UNAUTHORIZED, detail=EMAIL_OR_VERIFICATION_CODE_WRONG
             )
         if account.status != "NORMAL":
+            record_audit_event(
+                "login", False, account_id=account.id, email=email, ip=ip
+            )
             raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="账户状态异常")
 
-        encoded_jwt = await create_access_token(account.id)
+        account_id = account.id
+        encoded_jwt = await create_access_token(account_id)
 
         refresh_token = await create_refresh_token(
-            account.id,
+            account_id,
             datetime.datetime.now().timestamp() + get_config().refresh_token_lifespan,
             session,
         )
 
         await set_refresh_token(response, refresh_token)
 
+        record_audit_event("login", True, account_id=account_id, email=email, ip=ip)
+
         return Token(access_token=encoded_jwt)
 
 
 @router.post("/refresh")
 async def refresh_access_token(
-    response: Response, refresh_token: Annotated[RefreshTokenInRequest, Cookie()]
+    request: Request,
+    response: Response,
+    refresh_token: Annotated[RefreshTokenInRequest, Cookie()],
 ) -> Token:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -156,33 +209,42 @@ async def refresh_access_token(
         headers={"WWW-Authenticate": "Bearer"},
     )
     (lookup_id, request_token) = refresh_token.refresh_token.split(".")
+    ip = get_remote_address(request)
     async with make_session() as session:
         target_token = await session.get(RefreshToken, lookup_id)
         if (target_token is None) or (
             not secrets.compare_digest(request_token, target_token.token)
         ):
+            record_audit_event("refresh", False, ip=ip)
             raise credentials_exception
         if target_token.expire < datetime.datetime.now().timestamp():
+            record_audit_event(
+                "refresh", False, account_id=target_token.owner_id, ip=ip
+            )
             session.delete(target_token)
             await session.commit()
             raise credentials_exception
         owner = await session.get(Account, target_token.owner_id)
         if owner is None or owner.status != "NORMAL":
+            record_audit_event(
+                "refresh", False, account_id=target_token.owner_id, ip=ip
+            )
             raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="账户状态异常")
-        owner_id = str(target_token.owner_id)
+        owner_id = target_token.owner_id
         await rotate_refresh_token(response, target_token, session)
-        return Token(access_token=await create_access_token(owner_id))
+        record_audit_event("refresh", True, account_id=owner_id, ip=ip)
+        return Token(access_token=await create_access_token(str(owner_id)))
 
 
 async def get_current_account(token: Annotated[str, Depends(oauth2_scheme)]):
-    config = get_config()
+    (_, public_key) = get_config_snapshot().derived(load_jwt_keys)
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="无法验证凭证",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, config.jwt_es256_public_key, algorithms="ES256")
+        payload = jwt.decode(token, public_key, algorithms="ES256")
         id: str = payload.get("sub")
         async with make_session() as session:
             account = await session.get(Account, id)
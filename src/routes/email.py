@@ -1,21 +1,73 @@
 import asyncio
+import base64
 import datetime
 import secrets
 from email.message import EmailMessage
+from email.policy import SMTP
 from email.utils import formataddr
-from typing import Annotated
+from typing import Annotated, Optional
 
 from fastapi import APIRouter, Body, Depends, HTTPException, Request
 from pydantic import EmailStr, Field
-
-from ..config import get_config, global_share, limiter, make_session
-from ..models import EmailDomainRestrictionInfo
-from ..smtp import send_message
+from slowapi.util import get_remote_address
+
+from ..audit import AuditEventType, record_audit_event
+from ..config import (
+    get_config,
+    get_config_snapshot,
+    global_share,
+    limiter,
+    make_session,
+)
+from ..models import Config, EmailDomainRestrictionInfo
 from ..sql import EmailVerificationCode
 
 router = APIRouter(prefix="/email")
 
 
+class VerificationCodeMessageTemplate:
+    """预先渲染的验证码邮件模板，发送时只需替换收件人与验证码"""
+
+    def __init__(self, from_name: Optional[str], from_email: str, code_lifespan: float):
+        self.from_email = from_email
+        self.body = (
+            "您的邮件验证码为：{code}，请勿透露给他人，"
+            f"验证码 {code_lifespan:.0f} 秒内有效。\n"
+        )
+        msg = EmailMessage()
+        msg["Subject"] = "邮件验证码"
+        msg["From"] = formataddr((from_name, from_email))
+        msg.set_content(self.body, cte="base64")
+        self.headers = msg.as_bytes(policy=SMTP).split(b"\r\n\r\n", 1)[0]
+
+    def render(self, to: str, code: str) -> tuple[bytes, tuple[str, ...]]:
+        """:return: 报文与 MAIL 命令的选项"""
+        body = base64.encodebytes(self.body.format(code=code).encode("utf-8"))
+        data = b"".join(
+            (
+                b"To: ",
+                to.encode("utf-8"),
+                b"\r\n",
+                self.headers,
+                b"\r\n\r\n",
+                body.replace(b"\n", b"\r\n"),
+            )
+        )
+        return data, () if to.isascii() else ("SMTPUTF8",)
+
+
+def build_message_template(config: Config) -> VerificationCodeMessageTemplate:
+    return VerificationCodeMessageTemplate(
+        config.email_verification_code_from_name,
+        config.email_verification_code_from_email,
+        config.email_verification_code_lifespan,
+    )
+
+
+def build_restricted_email_domains(config: Config) -> frozenset[str]:
+    return frozenset(domain.lower() for domain in config.restricted_email_domains)
+
+
 async def verify_email_and_consume_code(email: str, request_code: str) -> bool:
     async with make_session() as session:
         code = await session.get(EmailVerificationCode, email)
@@ -36,20 +88,44 @@ async def verify_email_and_consume_code(email: str, request_code: str) -> bool:
 async def allowed_email(
     email: Annotated[EmailStr, Body(embed=True), Field(max_length=129)],
 ) -> str:
-    config = get_config()
+    config_snapshot = get_config_snapshot()
+    config = config_snapshot.config
 
     if config.restrict_email_domains == "no":
         return email
-    domain = email.split("@")[-1]
+    domain = email.split("@")[-1].lower()
+    restricted_email_domains = config_snapshot.derived(build_restricted_email_domains)
     if config.restrict_email_domains == "blacklist":
-        if domain in config.restricted_email_domains:
+        if domain in restricted_email_domains:
             raise HTTPException(400, detail="邮箱域名处于黑名单中")
     if config.restrict_email_domains == "whitelist":
-        if domain not in config.restricted_email_domains:
+        if domain not in restricted_email_domains:
             raise HTTPException(400, detail="邮箱域名不处于白名单中")
     return email
 
 
+def audited_allowed_email(event: AuditEventType):
+    """与 ``allowed_email`` 相同，但会将被拒绝的邮箱记录为失败的审计事件"""
+
+    async def dependency(
+        request: Request,
+        email: Annotated[EmailStr, Body(embed=True), Field(max_length=129)],
+    ) -> str:
+        try:
+            return await allowed_email(email)
+        except HTTPException:
+            record_audit_event(
+                event,
+                False,
+                email=email,
+                ip=get_remote_address(request),
+                detail="domain_rejected",
+            )
+            raise
+
+    return dependency
+
+
 @router.get("/domain_restriction_info", response_model=EmailDomainRestrictionInfo)
 async def email_domain_restriction_info():
     config = get_config()
@@ -62,14 +138,22 @@ async def email_domain_restriction_info():
 
 @router.post(
     "/send_verification_code",
-    responses={400: {"description": "请求被拒绝"}},
+    responses={
+        400: {"description": "请求被拒绝"},
+        503: {"description": "服务正在关闭"},
+    },
     status_code=202,
 )
 @limiter.limit("10/hour")
 async def email_send_verification_code(
-    request: Request, email: Annotated[str, Depends(allowed_email)]
+    request: Request,
+    email: Annotated[str, Depends(audited_allowed_email("send_verification_code"))],
 ):
-    config = get_config()
+    if not global_share.accepting_background_tasks:
+        raise HTTPException(503, detail="服务正在关闭，请稍后重试")
+
+    config_snapshot = get_config_snapshot()
+    config = config_snapshot.config
 
     code: str = "".join(
         secrets.choice(config.email_verification_code_alphabet) for i in range(6)
@@ -86,20 +170,14 @@ async def email_send_verification_code(
             await session.delete(exist)
         session.add(code_item)
         await session.commit()
-    msg = EmailMessage()
-    msg.set_content(
-        f"您的邮件验证码为：{code}，请勿透露给他人，验证码 {config.email_verification_code_lifespan:.0f} 秒内有效。"
-    )
-    msg["Subject"] = "邮件验证码"
-    msg["From"] = formataddr(
-        (
-            config.email_verification_code_from_name,
-            config.email_verification_code_from_email,
+    template = config_snapshot.derived(build_message_template)
+    (data, mail_options) = template.render(email, code)
+
+    task = asyncio.create_task(
+        global_share.smtp_sender.send(
+            template.from_email, email, data, mail_options=mail_options
         )
     )
-    msg["To"] = email
-
-    task = asyncio.create_task(send_message(global_share.smtp_conn_pool, msg))
 
     global_share.background_tasks.add(task)
     # 重要！
@@ -107,3 +185,23 @@ async def email_send_verification_code(
     # https://docs.python.org/zh-cn/3/library/asyncio-task.html#asyncio.create_task
 
     task.add_done_callback(global_share.background_tasks.discard)
+
+    ip = get_remote_address(request)
+
+    def record_send_result(task: asyncio.Task):
+        if task.cancelled():
+            record_audit_event(
+                "send_verification_code", False, email=email, ip=ip, detail="cancelled"
+            )
+        elif task.exception() is not None:
+            record_audit_event(
+                "send_verification_code",
+                False,
+                email=email,
+                ip=ip,
+                detail=type(task.exception()).__name__[:64],
+            )
+        else:
+            record_audit_event("send_verification_code", True, email=email, ip=ip)
+
+    task.add_done_callback(record_send_result)
@@ -0,0 +1,21 @@
+from fastapi import APIRouter
+
+from ..config import global_share
+from ..models import AdmissionStatus
+
+router = APIRouter(prefix="/status")
+
+
+@router.get("/admission")
+async def admission_status() -> dict[str, AdmissionStatus]:
+    """各准入控制组的当前状态，键为组名"""
+    return {
+        limiter.name: AdmissionStatus(
+            in_flight=limiter.in_flight,
+            queued=limiter.queued,
+            rejected=limiter.rejected,
+            max_concurrency=limiter.max_concurrency,
+            max_queue=limiter.max_queue,
+        )
+        for limiter in (global_share.admission_limiters or {}).values()
+    }
@@ -1,11 +1,12 @@
 import asyncio
 from collections import deque
 from contextlib import asynccontextmanager
-from email.message import EmailMessage
-from typing import Optional
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Optional
 
-from aiosmtplib import SMTP
-from aiosmtplib.typing import Default
+if TYPE_CHECKING:
+    # aiosmtplib 在首次建立连接时才导入
+    from aiosmtplib import SMTP
 
 
 class SMTPClientFactory:
@@ -20,74 +21,187 @@ class SMTPClientFactory:
         password: Optional[str] = None,
     ):
         self.hostname = hostname
-        self.port = Default.token if port is None or port == 0 else port
+        self.port = None if port == 0 else port  # None 表示按 use_tls 使用默认端口
         self.use_tls = use_tls
         self.username = username
         self.password = password
 
+    async def connect(self) -> "SMTP":
+        """创建一个已连接（并已登录）的 SMTP 客户端"""
+        from aiosmtplib import SMTP
+
+        smtp = SMTP()
+        await smtp.connect(hostname=self.hostname, port=self.port, use_tls=self.use_tls)
+        if self.username is not None:
+            await smtp.login(self.username, self.password)
+        return smtp
+
     @asynccontextmanager
     async def get_client(self):
         """获取一个独立的SMTP客户端上下文"""
-        smtp = SMTP()
+        smtp = await self.connect()
         try:
-            await smtp.connect(
-                hostname=self.hostname, port=self.port, use_tls=self.use_tls
-            )
-            if self.username is not None:
-                await smtp.login(self.username, self.password)
             yield smtp
         finally:
             await smtp.quit()
 
 
 class SMTPConnectionPool:
+    """SMTP 连接池。
+
+    每个连接都记录创建它的工厂；替换 ``factory`` 后，旧工厂创建的连接
+    在归还或取出时断开，不再复用。"""
+
     def __init__(self, factory: SMTPClientFactory, max_size: int = 10):
         self.factory = factory
         self.max_size = max_size
-        self.pool = deque()
-        self.size = 0
+        self.pool: deque[tuple["SMTP", SMTPClientFactory]] = deque()
+        self.size = 0  # 已创建且尚未断开的连接数
         self.lock = asyncio.Lock()
 
     @asynccontextmanager
     async def get_connection(self):
         async with self.lock:
-            smtp: SMTP = None
-            if len(self.pool) > 0:
-                smtp = self.pool.popleft()
-            if (smtp is None and self.size < self.max_size) or (
-                smtp is not None and not smtp.is_connected
-            ):
-                smtp = SMTP()
-                await smtp.connect(
-                    hostname=self.factory.hostname,
-                    port=self.factory.port,
-                    use_tls=self.factory.use_tls,
-                )
-                if self.factory.username is not None:
-                    await smtp.login(self.factory.username, self.factory.password)
+            smtp: "SMTP" = None
+            while len(self.pool) > 0:
+                (candidate, factory) = self.pool.popleft()
+                if factory is self.factory and candidate.is_connected:
+                    smtp = candidate
+                    break
+                await self._discard(candidate)
+            factory = self.factory
+            if smtp is None:
+                smtp = await factory.connect()
                 self.size += 1
-            else:
-                # 等待连接可用或创建新连接
-                smtp = SMTP()
-                await smtp.connect(
-                    hostname=self.factory.hostname,
-                    port=self.factory.port,
-                    use_tls=self.factory.use_tls,
-                )
-                if self.factory.username:
-                    await smtp.login(self.factory.username, self.factory.password)
 
         try:
             yield smtp
         finally:
             async with self.lock:
-                if len(self.pool) < self.max_size:
-                    self.pool.append(smtp)
+                if factory is self.factory and len(self.pool) < self.max_size:
+                    self.pool.append((smtp, factory))
                 else:
-                    await smtp.quit()
-                    self.size -= 1
+                    await self._discard(smtp)
+
+    async def _discard(self, smtp: "SMTP"):
+        self.size -= 1
+        if not smtp.is_connected:
+            return
+        try:
+            await smtp.quit()
+        except Exception:
+            smtp.close()
+
+    async def close(self):
+        """断开连接池中所有空闲连接"""
+        async with self.lock:
+            while len(self.pool) > 0:
+                (smtp, _) = self.pool.popleft()
+                await self._discard(smtp)
+
+
+@dataclass
+class OutgoingMessage:
+    sender: str
+    recipient: str
+    data: bytes  # 完整的 RFC 5322 报文
+    mail_options: tuple[str, ...] = ()
+    future: asyncio.Future = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future()
+    )
 
 
-async def send_message(pool: SMTPConnectionPool, message: EmailMessage):
-    async with pool.get_connection() as conn:
-        await conn.send_message(message)
+class SMTPSender:
+    """将短时间内排队的邮件合并为一批，在同一个池化连接上连续发送。
+
+    :param coalesce_window: 收到一封邮件后，再等待多久以合并后续邮件（秒）
+    :param max_batch: 每批最多发送的邮件数"""
+
+    def __init__(
+        self,
+        pool: SMTPConnectionPool,
+        coalesce_window: float = 0.01,
+        max_batch: int = 100,
+    ):
+        self.pool = pool
+        self.coalesce_window = coalesce_window
+        self.max_batch = max_batch
+        self.queue: asyncio.Queue[OutgoingMessage] = asyncio.Queue()
+        self._slots = asyncio.Semaphore(pool.max_size)
+        self._batches: set[asyncio.Task] = set()
+        self._runner: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def send(
+        self,
+        sender: str,
+        recipient: str,
+        data: bytes,
+        mail_options: tuple[str, ...] = (),
+    ):
+        """排队发送一封邮件，并等待其发送完成。发送器关闭后调用会抛出 ``RuntimeError``"""
+        if self._closed:
+            raise RuntimeError("SMTPSender 已关闭")
+        message = OutgoingMessage(sender, recipient, data, mail_options)
+        self.queue.put_nowait(message)
+        await message.future
+
+    def start(self):
+        self._runner = asyncio.create_task(self._run())
+
+    async def close(self):
+        """停止合并发送，并取消仍在排队的邮件"""
+        self._closed = True
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+        if len(self._batches) > 0:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+        while not self.queue.empty():
+            self.queue.get_nowait().future.cancel()
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            try:
+                await asyncio.sleep(self.coalesce_window)
+                while len(batch) < self.max_batch and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                await self._slots.acquire()
+            except asyncio.CancelledError:
+                # 已从队列取出、尚未交给发送任务的邮件
+                for message in batch:
+                    message.future.cancel()
+                raise
+            task = asyncio.create_task(self._send_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+            task.add_done_callback(lambda _: self._slots.release())
+
+    async def _send_batch(self, batch: list[OutgoingMessage]):
+        try:
+            async with self.pool.get_connection() as conn:
+                for message in batch:
+                    if message.future.done():  # 等待者已取消
+                        continue
+                    try:
+                        await conn.sendmail(
+                            message.sender,
+                            [message.recipient],
+                            message.data,
+                            mail_options=message.mail_options,
+                        )
+                    except Exception as e:
+                        if not message.future.done():
+                            message.future.set_exception(e)
+                    else:
+                        if not message.future.done():  # 发送期间等待者可能已取消
+                            message.future.set_result(None)
+        except Exception as e:
+            for message in batch:
+                if not message.future.done():
+                    message.future.set_exception(e)
@@ -1,5 +1,5 @@
 import uuid
-from typing import List, Literal
+from typing import List, Literal, Optional
 
 from sqlalchemy import UUID, ForeignKey, String
 from sqlalchemy.orm import (
@@ -52,3 +52,24 @@ class RefreshToken(Base):
     token: Mapped[str] = mapped_column(String(64), nullable=False)
     expire: Mapped[float] = mapped_column(nullable=False)
     owner_id = mapped_column(ForeignKey("account.id"), index=True, nullable=False)
+
+
+class AuditEvent(Base):
+    """认证审计事件。
+
+    生产环境中可通过 Alembic 迁移将该表改为按 ``time`` 分区（每天一个分区）。"""
+
+    __tablename__ = "audit_event"
+
+    id: Mapped[uuid.UUID] = mapped_column(
+        UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
+    )
+    time: Mapped[float] = mapped_column(index=True, nullable=False)  # POSIX timestamp
+    event: Mapped[str] = mapped_column(String(32), nullable=False)
+    success: Mapped[bool] = mapped_column(nullable=False)
+    account_id: Mapped[Optional[uuid.UUID]] = mapped_column(
+        UUID(as_uuid=True), index=True
+    )  # 不使用外键，账户删除后仍保留审计记录
+    email: Mapped[Optional[str]] = mapped_column(String(129), index=True)
+    ip: Mapped[Optional[str]] = mapped_column(String(45))
+    detail: Mapped[Optional[str]] = mapped_column(String(64))  # 失败原因
@@ -0,0 +1,256 @@
+import asyncio
+import time
+import uuid
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from src.admission import (
+    AdmissionControlMiddleware,
+    AdmissionRejected,
+    ConcurrencyLimiter,
+)
+from src.config import (
+    get_config_snapshot,
+    global_share,
+    make_config_snapshot,
+    set_config,
+    set_config_snapshot,
+)
+from src.models import AdmissionControlGroup
+
+
+def test_limiter_queue_and_reject():
+    async def main():
+        limiter = ConcurrencyLimiter("test", max_concurrency=1, max_queue=1)
+        release = asyncio.Event()
+
+        async def hold():
+            async with limiter.acquire():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        assert limiter.in_flight == 1
+        assert limiter.queued == 1
+
+        with pytest.raises(AdmissionRejected):
+            async with limiter.acquire():
+                pass
+        assert limiter.rejected == 1
+
+        release.set()
+        await asyncio.gather(holder, waiter)
+        assert limiter.in_flight == 0
+        assert limiter.queued == 0
+
+    asyncio.run(main())
+
+
+def test_limiter_queue_timeout():
+    async def main():
+        limiter = ConcurrencyLimiter(
+            "test", max_concurrency=1, max_queue=1, queue_timeout=0.01
+        )
+        async with limiter.acquire():
+            with pytest.raises(AdmissionRejected):
+                async with limiter.acquire():
+                    pass
+        assert limiter.queued == 0
+        assert limiter.rejected == 1
+
+    asyncio.run(main())
+
+
+def test_p99_holds_under_overload():
+    hold_time = 0.02
+    count = 200
+
+    async def run(with_limiter: bool) -> tuple[list[float], list[httpx.Response]]:
+        engine_pool = asyncio.Semaphore(4)  # 模拟数据库引擎的连接池
+
+        async def slow(request):
+            async with engine_pool:
+                await asyncio.sleep(hold_time)
+            return PlainTextResponse("ok")
+
+        limiter = ConcurrencyLimiter(
+            "slow", max_concurrency=4, max_queue=4, queue_timeout=0.5, retry_after=3
+        )
+        app = Starlette(routes=[Route("/slow", slow)])
+        if with_limiter:
+            app.add_middleware(
+                AdmissionControlMiddleware, get_limiters=lambda: {"/slow": limiter}
+            )
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://test"
+        ) as client:
+
+            async def one():
+                start = time.perf_counter()
+                response = await client.get("/slow")
+                return response, time.perf_counter() - start
+
+            results = await asyncio.gather(*(one() for _ in range(count)))
+
+        assert limiter.in_flight == 0
+        assert limiter.queued == 0
+        return (
+            sorted(latency for _, latency in results),
+            [response for response, _ in results],
+        )
+
+    def p99(latencies: list[float]) -> float:
+        return latencies[int(len(latencies) * 0.99) - 1]
+
+    (limited_latencies, responses) = asyncio.run(run(with_limiter=True))
+    (unlimited_latencies, _) = asyncio.run(run(with_limiter=False))
+
+    rejected = [response for response in responses if response.status_code == 503]
+    assert {response.status_code for response in responses} == {200, 503}
+    assert all(response.headers["Retry-After"] == "3" for response in rejected)
+    # 有准入控制时至多排队一轮；没有时请求全部堆积在连接池后面
+    # 排队至多等待一轮；堆积则要等待约 count / 4 轮
+    backlog = hold_time * count / 4
+    assert p99(limited_latencies) < backlog / 2
+    assert p99(unlimited_latencies) > backlog / 2
+    assert p99(unlimited_latencies) > p99(limited_latencies) * 3
+
+
+def test_app_admission_control(test_config, monkeypatch):
+    from src import app
+
+    set_config(
+        test_config.model_copy(
+            update={
+                "admission_control": {
+                    "account": AdmissionControlGroup(
+                        paths=["/account/refresh"],
+                        max_concurrency=2,
+                        max_queue=1,
+                        queue_timeout=5.0,
+                    )
+                }
+            }
+        )
+    )
+    release = asyncio.Event()
+
+    class BlockedSession:
+        """阻塞到 release 被设置，模拟缓慢的数据库"""
+
+        async def __aenter__(self):
+            await release.wait()
+            raise HTTPException(401)
+
+        async def __aexit__(self, *args):
+            pass
+
+    monkeypatch.setattr("src.routes.account.make_session", BlockedSession)
+
+    async def main():
+        async with (
+            app.router.lifespan_context(app),
+            httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=app),
+                base_url="http://test",
+                cookies={"refresh_token": f"{uuid.uuid4()}.{'0' * 64}"},
+            ) as client,
+        ):
+
+            async def status():
+                response = await client.get("/status/admission")
+                assert response.status_code == 200
+                return response.json()["account"]
+
+            held = [
+                asyncio.create_task(client.post("/account/refresh")) for _ in range(3)
+            ]
+            for _ in range(100):
+                gauges = await status()
+                if gauges["in_flight"] == 2 and gauges["queued"] == 1:
+                    break
+                await asyncio.sleep(0.01)
+            assert gauges == {
+                "in_flight": 2,
+                "queued": 1,
+                "rejected": 0,
+                "max_concurrency": 2,
+                "max_queue": 1,
+            }
+
+            # 并发与队列均已满，立即拒绝
+            response = await client.post("/account/refresh")
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == "1"
+            assert (await status())["rejected"] == 1
+
+            # 不受准入控制的路由不受影响
+            response = await client.get("/email/domain_restriction_info")
+            assert response.status_code == 200
+
+            release.set()
+            assert [r.status_code for r in await asyncio.gather(*held)] == [401] * 3
+            gauges = await status()
+            assert (gauges["in_flight"], gauges["queued"]) == (0, 0)
+
+    asyncio.run(main())
+
+
+def test_reload_keeps_unchanged_limiters(test_config):
+    from src import app, on_config_reload
+
+    account = AdmissionControlGroup(paths=["/account/refresh"], max_concurrency=2)
+    email = AdmissionControlGroup(
+        paths=["/email/send_verification_code"], max_concurrency=2
+    )
+    set_config(
+        test_config.model_copy(
+            update={"admission_control": {"account": account, "email": email}}
+        )
+    )
+
+    async def main():
+        async with app.router.lifespan_context(app):
+            old = get_config_snapshot()
+            limiters = global_share.admission_limiters
+            account_limiter = limiters["/account/refresh"]
+            email_limiter = limiters["/email/send_verification_code"]
+            account_limiter.rejected = 3
+
+            async with account_limiter.acquire():
+                new = make_config_snapshot(
+                    old.config.model_copy(
+                        update={
+                            "admission_control": {
+                                # 仅增加路径，限制参数不变
+                                "account": account.model_copy(
+                                    update={
+                                        "paths": ["/account/refresh", "/account/login"]
+                                    }
+                                ),
+                                "email": email.model_copy(
+                                    update={"max_concurrency": 4}
+                                ),
+                            }
+                        }
+                    )
+                )
+                set_config_snapshot(new)
+                await on_config_reload(old, new)
+                limiters = global_share.admission_limiters
+                assert limiters["/account/refresh"] is account_limiter
+                assert limiters["/account/login"] is account_limiter
+                assert account_limiter.in_flight == 1
+            assert account_limiter.in_flight == 0
+            assert account_limiter.rejected == 3
+            assert limiters["/email/send_verification_code"] is not email_limiter
+            assert limiters["/email/send_verification_code"].max_concurrency == 4
+
+    asyncio.run(main())
@@ -0,0 +1,150 @@
+import asyncio
+import json
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.handlers import Sink
+from sqlalchemy import select
+
+from src.audit import AuditEntry, AuditLog, NDJSONAuditSink, get_audit_log
+from src.config import global_share, limiter, make_session
+from src.sql import AuditEvent
+
+
+class ListSink:
+    def __init__(self):
+        self.batches: list[list[AuditEntry]] = []
+
+    async def write(self, entries):
+        self.batches.append(entries)
+
+
+def test_audit_log_batches_and_drops():
+    async def main():
+        sink = ListSink()
+        audit_log = AuditLog(sink, buffer_size=4, batch_size=2, flush_interval=60)
+        audit_log.start()
+        for i in range(6):
+            audit_log.record(AuditEntry("login", True, email=f"{i}@example.com"))
+        assert audit_log.overflowed == 2
+        await audit_log.close()
+
+        emails = [entry.email for batch in sink.batches for entry in batch]
+        assert emails == [f"{i}@example.com" for i in range(2, 6)]
+        assert all(len(batch) <= 2 for batch in sink.batches)
+        assert audit_log.written == 4
+        assert audit_log.write_failed == 0
+
+    asyncio.run(main())
+
+
+class FailingSink:
+    async def write(self, entries):
+        raise OSError("磁盘已满")
+
+
+def test_audit_log_write_failure():
+    async def main():
+        audit_log = AuditLog(FailingSink(), buffer_size=2, batch_size=2)
+        for _ in range(3):
+            audit_log.record(AuditEntry("login", False))
+        await audit_log.close()
+        assert audit_log.overflowed == 1
+        assert audit_log.write_failed == 2
+        assert audit_log.written == 0
+
+    asyncio.run(main())
+
+
+def test_ndjson_sink(tmp_path):
+    async def main():
+        sink = NDJSONAuditSink(str(tmp_path / "audit"))
+        audit_log = AuditLog(sink)
+        audit_log.record(AuditEntry("refresh", False, ip="127.0.0.1", time=0.0))
+        audit_log.record(AuditEntry("refresh", True, ip="127.0.0.1", time=86400.0))
+        await audit_log.close()
+
+    asyncio.run(main())
+
+    first = (tmp_path / "audit" / "audit-1970-01-01.ndjson").read_text("utf-8")
+    second = (tmp_path / "audit" / "audit-1970-01-02.ndjson").read_text("utf-8")
+    assert json.loads(first)["success"] is False
+    assert json.loads(second)["success"] is True
+
+
+def test_audit_send_verification_code(test_client_with_config):
+    test_client = test_client_with_config[0]
+
+    async def fetch():
+        await asyncio.gather(*global_share.background_tasks, return_exceptions=True)
+        await get_audit_log().flush()
+        async with make_session() as session:
+            return (
+                (await session.execute(select(AuditEvent).order_by(AuditEvent.time)))
+                .scalars()
+                .all()
+            )
+
+    controller = Controller(Sink(), port=9901)
+    controller.start()
+    try:
+        test_client.post(
+            "/email/send_verification_code", json={"email": "receiver@example.com"}
+        )
+        events = test_client.portal.call(fetch)
+    finally:
+        controller.stop()
+    assert len(events) == 1
+    assert events[0].event == "send_verification_code"
+    assert events[0].email == "receiver@example.com"
+    assert events[0].success
+
+    # SMTP 服务器不可用时，发送失败也要被记录
+    test_client.post(
+        "/email/send_verification_code", json={"email": "receiver@example.com"}
+    )
+    # 被域名限制拒绝的请求
+    response = test_client.post(
+        "/email/send_verification_code", json={"email": "receiver@forbidden.com"}
+    )
+    assert response.status_code == 400
+    events = test_client.portal.call(fetch)[1:]
+    assert sorted((e.email, e.success) for e in events) == [
+        ("receiver@example.com", False),
+        ("receiver@forbidden.com", False),
+    ]
+    details = {e.email: e.detail for e in events}
+    assert details["receiver@forbidden.com"] == "domain_rejected"
+    assert details["receiver@example.com"] not in (None, "domain_rejected")
+
+
+def test_audit_rate_limited(test_client_with_config):
+    test_client = test_client_with_config[0]
+
+    async def fetch():
+        await asyncio.gather(*global_share.background_tasks, return_exceptions=True)
+        await get_audit_log().flush()
+        async with make_session() as session:
+            return (
+                (
+                    await session.execute(
+                        select(AuditEvent).where(AuditEvent.detail == "rate_limited")
+                    )
+                )
+                .scalars()
+                .all()
+            )
+
+    limiter.reset()
+    try:
+        for _ in range(11):
+            response = test_client.post(
+                "/email/send_verification_code",
+                json={"email": "receiver@example.com"},
+            )
+    finally:
+        limiter.reset()
+    assert response.status_code == 429
+    events = test_client.portal.call(fetch)
+    assert len(events) == 1
+    assert events[0].event == "send_verification_code"
+    assert not events[0].success
@@ -0,0 +1,165 @@
+import asyncio
+
+import jwt
+import pytest
+
+import src.config
+from src import prepare_config_snapshot
+from src.config import (
+    ConfigWatcher,
+    get_config,
+    get_config_snapshot,
+    set_config,
+)
+from src.routes.account import create_access_token, load_jwt_keys
+from src.routes.email import build_restricted_email_domains
+
+
+def write_config(path, test_config, **extra: float):
+    lines = [
+        f'db_conn_scheme = "{test_config.db_conn_scheme}"',
+        f'jwt_es256_private_key = """{test_config.jwt_es256_private_key}"""',
+        f'jwt_es256_public_key = """{test_config.jwt_es256_public_key}"""',
+        f'smtp_host = "{test_config.smtp_host}"',
+        f"smtp_port = {test_config.smtp_port}",
+        "smtp_use_tls = false",
+        'email_verification_code_from_email = "noreply@example.com"',
+        'restricted_email_domains = ["example.com"]',
+    ]
+    lines.extend(f"{name} = {value!r}" for name, value in extra.items())
+    path.write_text("\n".join(lines), "utf-8")
+
+
+@pytest.fixture
+def config_file(tmp_path, test_config, monkeypatch):
+    monkeypatch.setenv("TW_ACCOUNT_DATA_PATH", str(tmp_path))
+    monkeypatch.setattr("src.config._snapshot", None)
+    path = tmp_path / "config.toml"
+    write_config(path, test_config)
+    return path
+
+
+def test_derived_cache_per_version(test_config):
+    snapshot = get_config_snapshot()
+    domains = snapshot.derived(build_restricted_email_domains)
+    assert domains == frozenset({"example.com"})
+    assert snapshot.derived(build_restricted_email_domains) is domains
+
+    new_snapshot = set_config(
+        test_config.model_copy(update={"restricted_email_domains": {"Example.ORG"}})
+    )
+    assert new_snapshot.version > snapshot.version
+    assert new_snapshot.derived(build_restricted_email_domains) == frozenset(
+        {"example.org"}
+    )
+    assert snapshot.derived(build_restricted_email_domains) is domains
+
+
+def test_access_token_uses_parsed_keys(test_config):
+    token = asyncio.run(create_access_token("some-account"))
+    (_, public_key) = get_config_snapshot().derived(load_jwt_keys)
+    assert jwt.decode(token, public_key, algorithms="ES256")["sub"] == "some-account"
+
+
+def test_config_watcher_reload(config_file, test_config):
+    snapshot = get_config_snapshot()
+    assert snapshot.path == str(config_file)
+    assert get_config().access_token_lifespan == test_config.access_token_lifespan
+
+    prepared = []
+    reloaded = []
+
+    def prepare(new_snapshot):
+        new_snapshot.derived(load_jwt_keys)
+        prepared.append(new_snapshot)
+
+    async def on_reload(old_snapshot, new_snapshot):
+        reloaded.append((old_snapshot, new_snapshot))
+
+    async def main():
+        watcher = ConfigWatcher(
+            str(config_file), interval=60, prepare=prepare, on_reload=on_reload
+        )
+
+        # 未修改时不替换快照
+        assert not await watcher.reload()
+
+        # 无效的配置不会替换当前快照
+        config_file.write_text("db_conn_scheme = 1", "utf-8")
+        assert not await watcher.reload()
+        assert get_config_snapshot() is snapshot
+
+        write_config(config_file, test_config, access_token_lifespan=60.0)
+        assert await watcher.reload()
+
+    asyncio.run(main())
+
+    new_snapshot = get_config_snapshot()
+    assert new_snapshot.version > snapshot.version
+    assert new_snapshot.config.access_token_lifespan == 60.0
+    assert prepared == [new_snapshot]
+    assert load_jwt_keys in new_snapshot._derived
+    assert reloaded == [(snapshot, new_snapshot)]
+
+
+def test_config_watcher_polls_file(config_file, test_config):
+    snapshot = get_config_snapshot()
+
+    async def main():
+        watcher = ConfigWatcher(str(config_file), interval=0.01)
+        watcher.start()
+        write_config(config_file, test_config, refresh_token_lifespan=60.0)
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if get_config_snapshot() is not snapshot:
+                break
+        await watcher.close()
+
+    asyncio.run(main())
+
+    assert get_config().refresh_token_lifespan == 60.0
+    assert src.config._snapshot.path == str(config_file)
+
+
+def test_config_watcher_survives_bad_reload(config_file, test_config):
+    snapshot = get_config_snapshot()
+    reloads = []
+
+    async def on_reload(old, new):
+        reloads.append(new)
+        raise RuntimeError("on_reload 失败")
+
+    async def wait_for(condition):
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            if condition():
+                return
+
+    async def main():
+        watcher = ConfigWatcher(
+            str(config_file),
+            interval=0.01,
+            prepare=prepare_config_snapshot,
+            on_reload=on_reload,
+        )
+        watcher.start()
+
+        # 私钥无效，prepare 解析失败，保留当前快照
+        bad_mtime = watcher._mtime
+        write_config(
+            config_file,
+            test_config.model_copy(update={"jwt_es256_private_key": "invalid"}),
+        )
+        await wait_for(lambda: watcher._mtime != bad_mtime)
+        assert get_config_snapshot() is snapshot
+
+        # 之后的有效配置仍会被加载，即使 on_reload 出错
+        write_config(config_file, test_config, refresh_token_lifespan=60.0)
+        await wait_for(lambda: get_config_snapshot() is not snapshot)
+        assert not watcher._task.done()
+        await watcher.close()
+
+    asyncio.run(main())
+
+    assert get_config().refresh_token_lifespan == 60.0
+    assert len(reloads) == 1
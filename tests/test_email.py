@@ -1,13 +1,17 @@
 import asyncio
 import email
+import email.policy
+import threading
 import time
 from typing import Optional
 
+import pytest
 from aiosmtpd.controller import Controller
 from aiosmtpd.handlers import Message
 from aiosmtpd.smtp import Envelope
 
 import src.routes.email
+from src.smtp import SMTPClientFactory, SMTPConnectionPool, SMTPSender
 
 
 class SMTPHandlerForTesting(Message):
@@ -25,6 +29,230 @@ class SMTPHandlerForTesting(Message):
         return "250 OK"
 
 
+class CountingSMTPHandler:
+    def __init__(self):
+        self.sessions = set()
+        self.envelopes: list[Envelope] = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(session)
+        self.envelopes.append(envelope)
+        return "250 Message accepted for delivery"
+
+
+def test_message_template():
+    template = src.routes.email.VerificationCodeMessageTemplate(
+        "发件人", "noreply@example.com", 300.0
+    )
+    (data, mail_options) = template.render("receiver@example.com", "ABCDEF")
+    assert mail_options == ()
+    msg = email.message_from_bytes(data, policy=email.policy.default)
+    assert msg["To"] == "receiver@example.com"
+    assert msg["From"] == "发件人 <noreply@example.com>"
+    assert msg["Subject"] == "邮件验证码"
+    assert "ABCDEF" in msg.get_content()
+    assert "300 秒" in msg.get_content()
+
+
+def test_coalesced_send_throughput():
+    handler = CountingSMTPHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=9902)
+    controller.start()
+    count = 200
+
+    def make_pool():
+        return SMTPConnectionPool(
+            SMTPClientFactory(hostname="127.0.0.1", use_tls=False, port=9902)
+        )
+
+    def make_args(i: int):
+        return (
+            "noreply@example.com",
+            f"receiver{i}@example.com",
+            f"Subject: {i}\r\n\r\n{i}\r\n".encode(),
+        )
+
+    async def send_each():
+        """每封邮件单独从连接池取出一个连接发送"""
+        pool = make_pool()
+
+        async def send(i: int):
+            async with pool.get_connection() as conn:
+                (sender, recipient, data) = make_args(i)
+                await conn.sendmail(sender, [recipient], data)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(count)))
+        elapsed = time.perf_counter() - start
+        await pool.close()
+        return elapsed
+
+    async def send_coalesced():
+        pool = make_pool()
+        sender = SMTPSender(pool, coalesce_window=0.01, max_batch=count)
+        sender.start()
+        start = time.perf_counter()
+        await asyncio.gather(*(sender.send(*make_args(i)) for i in range(count)))
+        elapsed = time.perf_counter() - start
+        await sender.close()
+        await pool.close()
+        return elapsed
+
+    try:
+        each_elapsed = asyncio.run(send_each())
+        handler.sessions.clear()
+        handler.envelopes.clear()
+        coalesced_elapsed = asyncio.run(send_coalesced())
+    finally:
+        controller.stop()
+
+    assert len(handler.envelopes) == count
+    assert sorted(rcpt for e in handler.envelopes for rcpt in e.rcpt_tos) == sorted(
+        f"receiver{i}@example.com" for i in range(count)
+    )
+    # 同一时间窗口内排队的邮件应在同一个连接上连续发送
+    assert len(handler.sessions) == 1
+    # 合并发送省去了逐封建立连接的开销，应快于逐封发送
+    assert coalesced_elapsed < each_elapsed
+
+
+def test_pool_discards_connections_from_replaced_factory():
+    old_handler = CountingSMTPHandler()
+    new_handler = CountingSMTPHandler()
+    old_controller = Controller(old_handler, hostname="127.0.0.1", port=9905)
+    new_controller = Controller(new_handler, hostname="127.0.0.1", port=9906)
+    old_controller.start()
+    new_controller.start()
+
+    async def send(pool: SMTPConnectionPool, i: int):
+        async with pool.get_connection() as conn:
+            await conn.sendmail(
+                "noreply@example.com",
+                [f"receiver{i}@example.com"],
+                f"Subject: {i}\r\n\r\n{i}\r\n".encode(),
+            )
+
+    async def main():
+        pool = SMTPConnectionPool(
+            SMTPClientFactory(hostname="127.0.0.1", use_tls=False, port=9905)
+        )
+        await send(pool, 0)
+        await send(pool, 1)  # 复用空闲连接
+        assert pool.size == 1
+
+        async with pool.get_connection() as conn:
+            # 连接被取出期间替换工厂（如重新加载配置）
+            pool.factory = SMTPClientFactory(
+                hostname="127.0.0.1", use_tls=False, port=9906
+            )
+            await conn.sendmail(
+                "noreply@example.com",
+                ["receiver2@example.com"],
+                b"Subject: 2\r\n\r\n2\r\n",
+            )
+        # 旧工厂创建的连接在归还时断开
+        assert len(pool.pool) == 0
+        assert pool.size == 0
+
+        await send(pool, 3)
+        await pool.close()
+        assert pool.size == 0
+
+    try:
+        asyncio.run(main())
+    finally:
+        old_controller.stop()
+        new_controller.stop()
+
+    assert len(old_handler.sessions) == 1
+    assert [rcpt for e in old_handler.envelopes for rcpt in e.rcpt_tos] == [
+        "receiver0@example.com",
+        "receiver1@example.com",
+        "receiver2@example.com",
+    ]
+    assert [rcpt for e in new_handler.envelopes for rcpt in e.rcpt_tos] == [
+        "receiver3@example.com"
+    ]
+
+
+class SlowSMTPHandler(CountingSMTPHandler):
+    def __init__(self):
+        self.started = threading.Event()
+
+        super().__init__()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.started.set()
+        await asyncio.sleep(0.2)
+        return await super().handle_DATA(server, session, envelope)
+
+
+def test_cancel_waiter_during_batch():
+    handler = SlowSMTPHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=9904)
+    controller.start()
+
+    async def main():
+        pool = SMTPConnectionPool(
+            SMTPClientFactory(hostname="127.0.0.1", use_tls=False, port=9904)
+        )
+        sender = SMTPSender(pool, coalesce_window=0.01)
+        sender.start()
+        (first, second) = (
+            asyncio.create_task(
+                sender.send(
+                    "noreply@example.com",
+                    f"receiver{i}@example.com",
+                    f"Subject: {i}\r\n\r\n{i}\r\n".encode(),
+                )
+            )
+            for i in range(2)
+        )
+        # 在第一封邮件发送期间取消其等待者
+        assert await asyncio.to_thread(handler.started.wait, 5)
+        first.cancel()
+        await second
+        await sender.close()
+        await pool.close()
+        return first
+
+    try:
+        first = asyncio.run(main())
+    finally:
+        controller.stop()
+
+    assert first.cancelled()
+    assert [rcpt for e in handler.envelopes for rcpt in e.rcpt_tos] == [
+        "receiver0@example.com",
+        "receiver1@example.com",
+    ]
+
+
+def test_close_during_coalesce_window():
+    async def main():
+        pool = SMTPConnectionPool(
+            SMTPClientFactory(hostname="127.0.0.1", use_tls=False, port=9907)
+        )
+        sender = SMTPSender(pool, coalesce_window=60)
+        sender.start()
+        task = asyncio.create_task(
+            sender.send("noreply@example.com", "receiver@example.com", b"")
+        )
+        await asyncio.sleep(0.05)
+        assert sender.queue.empty()  # 邮件已被取出，正处于合并窗口中
+        await sender.close()
+        await asyncio.wait_for(asyncio.gather(task, return_exceptions=True), 1)
+        assert task.cancelled()
+
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(
+                sender.send("noreply@example.com", "receiver@example.com", b""), 1
+            )
+        await pool.close()
+
+    asyncio.run(main())
+
+
 def test_get_email_domain_restriction_info(test_client_with_config):
     test_client = test_client_with_config[0]
     response = test_client.get("/email/domain_restriction_info")
@@ -35,11 +263,10 @@ def test_get_email_domain_restriction_info(test_client_with_config):
     }
 
 
-def test_email_verification_code(test_client_with_config, monkeypatch):
-    test_client, config = test_client_with_config
+def test_email_verification_code(test_client_with_config, override_config):
+    test_client = test_client_with_config[0]
 
-    with monkeypatch.context() as m:
-        m.setattr(config, "email_verification_code_alphabet", "F")
+    with override_config(email_verification_code_alphabet="F"):
         test_client.post(
             "/email/send_verification_code", json={"email": "receiver@example.com"}
         )
@@ -73,8 +300,7 @@ def test_email_verification_code(test_client_with_config, monkeypatch):
         src.routes.email.verify_email_and_consume_code("receiver@example.com", "TTTTTT")
     )
 
-    with monkeypatch.context() as m:
-        m.setattr(config, "email_verification_code_lifespan", -1024.0)
+    with override_config(email_verification_code_lifespan=-1024.0):
         response = test_client.post(
             "/email/send_verification_code", json={"email": "receiver@example.com"}
         )
@@ -84,20 +310,20 @@ def test_email_verification_code(test_client_with_config, monkeypatch):
     )
 
 
-def test_email_domain_restriction(test_client_with_config, monkeypatch):
-    test_client, config = test_client_with_config
+def test_email_domain_restriction(test_client_with_config, override_config):
+    test_client = test_client_with_config[0]
 
-    with monkeypatch.context() as m:
-        m.setattr(config, "restrict_email_domains", "whitelist")
-        m.setattr(config, "restricted_email_domains", {"example.com"})
+    with override_config(
+        restrict_email_domains="whitelist", restricted_email_domains={"example.com"}
+    ):
         response = test_client.post(
             "/email/send_verification_code", json={"email": "receiver@forbidden.com"}
         )
         assert response.status_code == 400
 
-    with monkeypatch.context() as m:
-        m.setattr(config, "restrict_email_domains", "blacklist")
-        m.setattr(config, "restricted_email_domains", {"forbidden.com"})
+    with override_config(
+        restrict_email_domains="blacklist", restricted_email_domains={"forbidden.com"}
+    ):
         response = test_client.post(
             "/email/send_verification_code", json={"email": "receiver@forbidden.com"}
         )
@@ -0,0 +1,68 @@
+import asyncio
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.handlers import Sink
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.config import global_share, set_config
+
+
+def test_shutdown_drains_background_tasks(test_config, monkeypatch):
+    from src import app, shutdown
+
+    set_config(test_config.model_copy(update={"shutdown_timeout": 0.1}))
+    tasks: dict[str, asyncio.Task] = {}
+    disposed: list[AsyncEngine] = []
+    dispose = AsyncEngine.dispose
+
+    async def spy_dispose(engine: AsyncEngine, *args, **kwargs):
+        disposed.append(engine)
+        await dispose(engine, *args, **kwargs)
+
+    monkeypatch.setattr(AsyncEngine, "dispose", spy_dispose)
+
+    async def spawn(name: str, delay: float):
+        task = asyncio.create_task(asyncio.sleep(delay))
+        global_share.background_tasks.add(task)
+        task.add_done_callback(global_share.background_tasks.discard)
+        tasks[name] = task
+
+    async def check_out_connection():
+        async with global_share.smtp_conn_pool.get_connection() as conn:
+            return conn
+
+    controller = Controller(Sink(), port=test_config.smtp_port)
+    controller.start()
+    try:
+        with TestClient(app) as test_client:
+            engine = global_share.engine
+            conn = test_client.portal.call(check_out_connection)
+            assert conn.is_connected
+            assert len(global_share.smtp_conn_pool.pool) == 1
+
+            test_client.portal.call(spawn, "fast", 0.01)
+            test_client.portal.call(spawn, "slow", 60)
+            dropped = test_client.portal.call(shutdown, 0.1)
+    finally:
+        controller.stop()
+
+    assert dropped == 1
+    assert not global_share.accepting_background_tasks
+    assert tasks["fast"].done() and not tasks["fast"].cancelled()
+    assert tasks["slow"].cancelled()
+    # 空闲连接已 QUIT，数据库引擎已释放
+    assert not conn.is_connected
+    assert len(global_share.smtp_conn_pool.pool) == 0
+    assert global_share.smtp_conn_pool.size == 0
+    assert engine in disposed
+
+
+def test_reject_email_tasks_when_shutting_down(test_client_with_config, monkeypatch):
+    test_client = test_client_with_config[0]
+
+    monkeypatch.setattr(global_share, "accepting_background_tasks", False)
+    response = test_client.post(
+        "/email/send_verification_code", json={"email": "receiver@example.com"}
+    )
+    assert response.status_code == 503
@@ -0,0 +1,76 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+# 应用启动耗时的绝大部分来自 FastAPI 与 SQLAlchemy 本身，无法避免，
+# 因此只为本项目模块自身的导入耗时设预算（秒）。实测约 0.06~0.08 秒
+SRC_IMPORT_BUDGET = 0.1
+# lifespan 启动（建表、解析密钥、初始化连接池等），实测约 0.03~0.045 秒
+LIFESPAN_STARTUP_BUDGET = 0.1
+
+# 导入应用及启动完成后都不应导入的依赖（直到首次发送邮件）
+LAZY_MODULES = ["aiosmtplib", "platformdirs"]
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+def run_in_subprocess(code: str, *args: str) -> dict:
+    """在新的解释器中执行，避免测试进程中已导入的模块影响计时"""
+    return json.loads(
+        subprocess.run(
+            [sys.executable, "-c", code, *args],
+            cwd=PROJECT_ROOT,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+    )
+
+
+def test_import_time():
+    importtime = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import src"],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stderr
+    # 每行格式为 "import time: <自身耗时 us> | <累计耗时 us> | <缩进><模块名>"
+    self_times: dict[str, int] = {}
+    for line in importtime.splitlines()[1:]:
+        (self_us, _, module) = line.removeprefix("import time:").split("|")
+        self_times[module.strip()] = int(self_us)
+
+    assert [m for m in LAZY_MODULES if m in self_times] == []
+    src_self_time = sum(
+        us for (m, us) in self_times.items() if m == "src" or m.startswith("src.")
+    )
+    assert src_self_time / 1_000_000 < SRC_IMPORT_BUDGET
+
+
+def test_lifespan_startup_time(test_config):
+    result = run_in_subprocess(
+        f"""
+import asyncio, json, sys, time
+import src
+from src.config import set_config
+from src.models import Config
+
+set_config(Config.model_validate_json(sys.argv[1]))
+
+
+async def main():
+    start = time.perf_counter()
+    async with src.app.router.lifespan_context(src.app):
+        elapsed = time.perf_counter() - start
+        loaded = [m for m in {LAZY_MODULES!r} if m in sys.modules]
+    return {{"elapsed": elapsed, "loaded": loaded}}
+
+
+print(json.dumps(asyncio.run(main())))
+""",
+        test_config.model_dump_json(),
+    )
+    assert result["loaded"] == []
+    assert result["elapsed"] < LIFESPAN_STARTUP_BUDGET